@@ -0,0 +1,145 @@
+"""
+Benchmark de serialización de respuestas (antes / después de orjson + modelos tipados).
+
+Usa la misma ruta que FastAPI (`fastapi.routing.serialize_response`) y el render
+de la clase de respuesta, sin red ni base de datos:
+
+- students: 1000 estudiantes (antes: objetos tipo ORM + StudentOut + JSONResponse;
+  ahora: tuplas SQL -> dict -> ORJSONResponse, sin validación por fila)
+- games:    100 partidas (antes: dict + jsonable_encoder + JSONResponse;
+  ahora: StudentGamesOut + ORJSONResponse)
+- report:   reporte pedagógico (antes: dict + jsonable_encoder + JSONResponse;
+  ahora: StudentReportOut + ORJSONResponse)
+
+Uso (desde la raíz del repo):
+
+    python bench/serialize.py
+"""
+from __future__ import annotations
+
+import asyncio
+import pathlib
+import sys
+import timeit
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from fastapi.responses import JSONResponse, ORJSONResponse  # noqa: E402
+from fastapi.routing import serialize_response  # noqa: E402
+from fastapi.utils import create_model_field  # noqa: E402
+
+from schemas import StudentGamesOut, StudentOut, StudentReportOut  # noqa: E402
+
+
+N_STUDENTS = 1000
+N_GAMES = 100
+NUMBER = 200
+REPEAT = 5
+
+NOW = datetime(2026, 1, 1, tzinfo=timezone.utc)
+_loop = asyncio.new_event_loop()
+
+
+def _serialize(content, field=None) -> bytes:
+    return _loop.run_until_complete(serialize_response(field=field, response_content=content))
+
+
+def _field(type_):
+    return create_model_field(name="Response_bench", type_=type_, mode="serialization")
+
+
+# ---------- PAYLOADS ----------
+STUDENT_FIELDS = tuple(StudentOut.model_fields)
+student_tuples = [
+    (i, f"Estudiante {i}", "primaria" if i % 2 else "bachillerato", str(5 + i % 6), f"alumno_{i}")
+    for i in range(N_STUDENTS, 0, -1)
+]
+student_objects = [SimpleNamespace(**dict(zip(STUDENT_FIELDS, t))) for t in student_tuples]
+
+games_payload = {
+    "student_id": 1,
+    "count": N_GAMES,
+    "games": [
+        {
+            "lichess_game_id": f"g{i:07d}",
+            "played_at": NOW - timedelta(hours=i),
+            "speed": "blitz",
+            "perf": "Blitz",
+        }
+        for i in range(N_GAMES)
+    ],
+}
+
+report_payload = {
+    "student": {"id": 1, "name": "Estudiante 1", "level": "primaria", "grade": "5", "lichess_username": "alumno_1"},
+    "activity": {
+        "days_window": 30,
+        "games_in_window": 42,
+        "games_last_7_days": 9,
+        "games_per_week_estimated": 9.8,
+        "last_played_at": NOW,
+        "days_since_last_game": 1,
+        "games_last_7d": 9,
+    },
+    "performance": {"wins": 20, "losses": 15, "draws": 3, "known_results": 38, "win_rate_percent": 52.6},
+    "profile": {
+        "top_speeds": ["blitz", "rapid"],
+        "top_perfs": ["Blitz", "Rapid"],
+        "top_openings": ["Italian Game", "Sicilian Defense", "French Defense"],
+    },
+    "traffic_lights": {
+        "activity": "green",
+        "performance": "yellow",
+        "stability": "yellow",
+        "messages": ["En observación: señales mixtas (hábito y rendimiento no están alineados)."],
+    },
+}
+
+
+# ---------- RUTAS ----------
+students_field = _field(list[StudentOut])
+games_field = _field(StudentGamesOut)
+report_field = _field(StudentReportOut)
+
+
+def students_old() -> bytes:
+    return JSONResponse(_serialize(student_objects, students_field)).body
+
+def students_new() -> bytes:
+    return ORJSONResponse([dict(zip(STUDENT_FIELDS, r)) for r in student_tuples]).body
+
+def games_old() -> bytes:
+    return JSONResponse(_serialize(games_payload)).body
+
+def games_new() -> bytes:
+    return ORJSONResponse(_serialize(games_payload, games_field)).body
+
+def report_old() -> bytes:
+    return JSONResponse(_serialize(report_payload)).body
+
+def report_new() -> bytes:
+    return ORJSONResponse(_serialize(report_payload, report_field)).body
+
+
+CASES = [
+    (f"students ({N_STUDENTS})", students_old, students_new),
+    (f"games ({N_GAMES})", games_old, games_new),
+    ("report", report_old, report_new),
+]
+
+
+def _best_us(fn) -> float:
+    return min(timeit.repeat(fn, number=NUMBER, repeat=REPEAT)) / NUMBER * 1e6
+
+
+def main() -> None:
+    print(f"{'payload':<18}{'antes (µs)':>12}{'ahora (µs)':>12}{'speedup':>10}{'bytes':>10}")
+    for name, old, new in CASES:
+        t_old, t_new = _best_us(old), _best_us(new)
+        print(f"{name:<18}{t_old:>12.1f}{t_new:>12.1f}{t_old / t_new:>9.1f}x{len(new()):>10}")
+
+
+if __name__ == "__main__":
+    main()
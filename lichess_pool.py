@@ -0,0 +1,307 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+import requests
+from dotenv import load_dotenv
+from sqlalchemy.orm import Session
+
+
+load_dotenv()
+
+LICHESS_BASE_URL = os.getenv("LICHESS_BASE_URL", "https://lichess.org").rstrip("/")
+# Presupuesto de requests por token y por minuto (ventana fija)
+TOKEN_BUDGET_PER_MINUTE = int(os.getenv("LICHESS_TOKEN_BUDGET_PER_MINUTE", "20"))
+# Regla oficial de Lichess: tras un 429, esperar un minuto completo
+COOLDOWN_SECONDS = float(os.getenv("LICHESS_COOLDOWN_SECONDS", "60"))
+
+WINDOW_SECONDS = 60.0
+# Con wait=True nunca dormimos más que esto seguido, para poder avisar (on_wait) a menudo
+MAX_WAIT_STEP_SECONDS = 15.0
+
+
+class LichessPoolExhausted(Exception):
+    """Todos los tokens están en cooldown, sin presupuesto u ocupados con un stream."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Rate limit Lichess (429) en todos los tokens. Espera {int(retry_after) + 1}s y reintenta.")
+        self.retry_after = retry_after
+
+
+@dataclass
+class TokenSlot:
+    label: str
+    token: Optional[str]        # None => acceso anónimo (sin token configurado)
+    source: str                 # "env" | "db" | "anonymous"
+
+    requests_total: int = 0
+    rate_limited_total: int = 0
+    errors_total: int = 0
+    in_flight: int = 0          # requests abiertos (un export en streaming cuenta hasta cerrarse)
+
+    window_started: float = 0.0
+    window_count: int = 0
+    cooldown_until: float = 0.0
+
+    last_used_at: Optional[datetime] = None
+    last_status: Optional[int] = None
+
+    def _roll_window(self, now: float) -> None:
+        if now - self.window_started >= WINDOW_SECONDS:
+            self.window_started = now
+            self.window_count = 0
+
+    def is_healthy(self, now: float, budget: int) -> bool:
+        self._roll_window(now)
+        return now >= self.cooldown_until and self.window_count < budget
+
+    def is_available(self, now: float, budget: int, stream: bool) -> bool:
+        # Lichess pide una sola descarga a la vez por cuenta: un stream necesita el token libre
+        return self.is_healthy(now, budget) and not (stream and self.in_flight)
+
+    def available_in(self, now: float, budget: int) -> float:
+        """Segundos hasta que el token vuelva a estar disponible (cooldown / presupuesto)."""
+        wait = max(self.cooldown_until - now, 0.0)
+        if self.window_count >= budget:
+            wait = max(wait, self.window_started + WINDOW_SECONDS - now)
+        return wait
+
+
+def _mask(token: Optional[str]) -> Optional[str]:
+    if not token:
+        return None
+    return f"{token[:4]}…{token[-4:]}" if len(token) > 8 else "…"
+
+
+def _env_tokens() -> List[str]:
+    """LICHESS_TOKENS (separados por coma) + LICHESS_TOKEN, sin duplicados."""
+    raw = (os.getenv("LICHESS_TOKENS") or "").split(",") + [os.getenv("LICHESS_TOKEN") or ""]
+    tokens: List[str] = []
+    for t in raw:
+        t = t.strip()
+        if t and t not in tokens:
+            tokens.append(t)
+    return tokens
+
+
+def primary_token() -> Optional[str]:
+    """Token principal: LICHESS_TOKEN, o el primero de LICHESS_TOKENS."""
+    token = (os.getenv("LICHESS_TOKEN") or "").strip()
+    if token:
+        return token
+    tokens = _env_tokens()
+    return tokens[0] if tokens else None
+
+
+class LichessTokenPool:
+    """
+    Reparte las llamadas a Lichess entre varios tokens.
+    Cada token lleva su propio presupuesto por minuto y su cooldown tras un 429,
+    así un 429 solo frena a ese token y no a toda la sincronización.
+    La contabilidad es en memoria: vale por proceso (ver docs/lichess_tokens.md).
+    """
+
+    def __init__(self, base_url: str = LICHESS_BASE_URL, budget_per_minute: int = TOKEN_BUDGET_PER_MINUTE,
+                 cooldown_seconds: float = COOLDOWN_SECONDS):
+        self.base_url = base_url
+        self.budget_per_minute = budget_per_minute
+        self.cooldown_seconds = cooldown_seconds
+        self._lock = threading.Lock()
+        # Avisa a quien espera token cuando se cierra un stream
+        self._released = threading.Condition(self._lock)
+        self._slots: List[TokenSlot] = []
+        self.load([("env", t) for t in _env_tokens()])
+
+    # ---------- CONFIGURACIÓN ----------
+    def load(self, tokens: List[tuple[str, str]], labels: Optional[List[str]] = None) -> None:
+        """
+        Reemplaza los tokens del pool. `tokens` es una lista de (source, token).
+        Los tokens que ya estaban conservan sus contadores y cooldown
+        (label y source sí se actualizan).
+        """
+        with self._lock:
+            previous = {s.token: s for s in self._slots}
+            slots: List[TokenSlot] = []
+            for i, (source, token) in enumerate(tokens):
+                label = labels[i] if labels else f"{source}-{i + 1}"
+                slot = previous.get(token)
+                if slot is None:
+                    slot = TokenSlot(label=label, token=token, source=source)
+                else:
+                    slot.label = label
+                    slot.source = source
+                slots.append(slot)
+            if not slots:
+                slots.append(previous.get(None) or TokenSlot(label="anonymous", token=None, source="anonymous"))
+            self._slots = slots
+
+    def load_from_db(self, db: Session) -> None:
+        """Tokens del entorno + tokens activos de la tabla lichess_tokens."""
+        # Import local: el pool se puede usar (y probar) sin DATABASE_URL
+        from models import LichessToken
+
+        entries = [("env", t) for t in _env_tokens()]
+        labels = [f"env-{i + 1}" for i in range(len(entries))]
+        known = {t for _, t in entries}
+        for row in db.query(LichessToken).filter(LichessToken.active == True).order_by(LichessToken.id).all():  # noqa: E712
+            if row.token in known:
+                continue
+            known.add(row.token)
+            entries.append(("db", row.token))
+            labels.append(row.label)
+        self.load(entries, labels)
+
+    # ---------- SELECCIÓN ----------
+    def _candidates(self, token: Optional[str]) -> List[TokenSlot]:
+        if token is None:
+            return self._slots
+        slots = [s for s in self._slots if s.token == token]
+        if not slots:
+            raise ValueError("Ese token no está en el pool de Lichess")
+        return slots
+
+    def _retry_after(self, slots: List[TokenSlot], now: float, stream: bool) -> float:
+        waits = []
+        for s in slots:
+            wait = s.available_in(now, self.budget_per_minute)
+            if stream and s.in_flight:
+                # No sabemos cuándo termina el stream: estimamos un paso de espera
+                wait = max(wait, MAX_WAIT_STEP_SECONDS)
+            waits.append(wait)
+        return min(waits)
+
+    def _acquire(self, wait: bool, on_wait: Optional[Callable[[], None]] = None, *,
+                 stream: bool = False, token: Optional[str] = None) -> TokenSlot:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                candidates = self._candidates(token)
+                available = [s for s in candidates if s.is_available(now, self.budget_per_minute, stream)]
+                if available:
+                    # Menos requests abiertos, luego menos uso de la ventana; en empate, el que lleva más tiempo sin usarse
+                    slot = min(available, key=lambda s: (
+                        s.in_flight,
+                        s.window_count,
+                        s.last_used_at or datetime.min.replace(tzinfo=timezone.utc),
+                    ))
+                    slot.in_flight += 1
+                    slot.window_count += 1
+                    slot.requests_total += 1
+                    slot.last_used_at = datetime.now(timezone.utc)
+                    return slot
+                retry_after = self._retry_after(candidates, now, stream)
+
+            if not wait:
+                raise LichessPoolExhausted(retry_after)
+            if on_wait:
+                on_wait()
+            with self._released:
+                self._released.wait(timeout=min(max(retry_after, 0.05), MAX_WAIT_STEP_SECONDS))
+
+    def _release(self, slot: TokenSlot) -> None:
+        with self._released:
+            slot.in_flight = max(slot.in_flight - 1, 0)
+            self._released.notify_all()
+
+    def _record(self, slot: TokenSlot, status: Optional[int]) -> None:
+        with self._lock:
+            slot.last_status = status
+            if status is None:
+                slot.errors_total += 1
+            elif status == 429:
+                slot.rate_limited_total += 1
+                slot.cooldown_until = time.monotonic() + self.cooldown_seconds
+
+    def _release_on_close(self, slot: TokenSlot, r: requests.Response) -> None:
+        """El token queda ocupado hasta que se cierre la respuesta (usar `with`)."""
+        close = r.close
+        released = False
+
+        def _close() -> None:
+            nonlocal released
+            try:
+                close()
+            finally:
+                if not released:
+                    released = True
+                    self._release(slot)
+
+        r.close = _close
+
+    # ---------- HTTP ----------
+    def get(self, path: str, *, headers: Optional[Dict[str, str]] = None, params: Optional[Dict[str, Any]] = None,
+            timeout: float = 30, stream: bool = False, wait: bool = False,
+            on_wait: Optional[Callable[[], None]] = None, token: Optional[str] = None) -> requests.Response:
+        """
+        GET a Lichess con el token más disponible. Ante un 429 se pone ese token
+        en cooldown y se reintenta con otro. Con wait=True (jobs en segundo plano)
+        se espera a que algún token se libere en vez de fallar; `on_wait` se llama
+        antes de cada espera (p. ej. para renovar el heartbeat del job).
+
+        Con stream=True solo se usa un token sin otro request abierto, y el token
+        sigue ocupado hasta cerrar la respuesta. `token` fija la llamada a ese token.
+        """
+        attempts = len(self._slots) * (3 if wait else 1)
+        for _ in range(attempts):
+            slot = self._acquire(wait, on_wait, stream=stream, token=token)
+
+            h = dict(headers or {})
+            if slot.token:
+                h["Authorization"] = f"Bearer {slot.token}"
+
+            try:
+                r = requests.get(f"{self.base_url}{path}", headers=h, params=params, timeout=timeout, stream=stream)
+            except requests.RequestException:
+                self._record(slot, None)
+                self._release(slot)
+                raise
+
+            self._record(slot, r.status_code)
+            if r.status_code == 429:
+                r.close()
+                self._release(slot)
+                continue
+
+            if stream:
+                self._release_on_close(slot, r)
+            else:
+                self._release(slot)
+            return r
+
+        with self._lock:
+            retry_after = self._retry_after(self._candidates(token), time.monotonic(), stream)
+        raise LichessPoolExhausted(retry_after)
+
+    # ---------- USO ----------
+    def usage(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            now = time.monotonic()
+            out = []
+            for s in self._slots:
+                s._roll_window(now)
+                cooldown = max(s.cooldown_until - now, 0.0)
+                out.append({
+                    "label": s.label,
+                    "source": s.source,
+                    "token": _mask(s.token),
+                    "healthy": s.is_healthy(now, self.budget_per_minute),
+                    "in_flight": s.in_flight,
+                    "requests_total": s.requests_total,
+                    "rate_limited_total": s.rate_limited_total,
+                    "errors_total": s.errors_total,
+                    "requests_this_minute": s.window_count,
+                    "budget_per_minute": self.budget_per_minute,
+                    "cooldown_remaining_seconds": round(cooldown, 1),
+                    "last_used_at": s.last_used_at,
+                    "last_status": s.last_status,
+                })
+            return out
+
+
+# Pool compartido por toda la app (endpoints y jobs de sync)
+pool = LichessTokenPool()
@@ -1,20 +1,49 @@
-from fastapi import FastAPI, Depends, HTTPException, Query
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Depends, HTTPException, Query, BackgroundTasks, Header
+from fastapi.responses import ORJSONResponse
 from sqlalchemy.orm import Session
 from dotenv import load_dotenv
 import os
-import requests
 import json
-
-from db import Base, engine, get_db
-from models import Student, Game
-from schemas import StudentCreate, StudentOut
+import secrets
+
+from db import Base, SessionLocal, engine, get_db
+from lichess_pool import LichessPoolExhausted, pool, primary_token
+from models import Student, Game, SyncJob
+from schemas import (
+    StudentCreate, StudentOut, SyncJobOut, StudentGamesOut, StudentReportOut, LichessTokenUsageOut,
+)
+from sync_jobs import get_or_create_job, run_sync_job, start_recovery_thread
 from traffic_lights import build_traffic_lights
 
 
 load_dotenv()
-LICHESS_TOKEN = os.getenv("LICHESS_TOKEN")
+ADMIN_SECRET = os.getenv("ADMIN_SECRET")
+
+def require_admin(x_admin_secret: str | None = Header(default=None)):
+    """Endpoints /admin: exigen la cabecera X-Admin-Secret igual a ADMIN_SECRET (sin ADMIN_SECRET quedan cerrados)."""
+    if not ADMIN_SECRET or not x_admin_secret or not secrets.compare_digest(x_admin_secret, ADMIN_SECRET):
+        raise HTTPException(status_code=403, detail="Acceso de administrador requerido")
+
+def _lichess_rate_limited(e: LichessPoolExhausted) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail=str(e),
+        headers={"Retry-After": str(int(e.retry_after) + 1)},
+    )
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Tokens de Lichess: entorno (LICHESS_TOKENS / LICHESS_TOKEN) + tabla lichess_tokens
+    with SessionLocal() as db:
+        pool.load_from_db(db)
+    # Reanuda jobs de sync que quedaron a medias por un reinicio/caída del worker
+    stop = start_recovery_thread()
+    yield
+    stop.set()
 
-app = FastAPI(title="Plataforma Ajedrez Iván")
+# orjson serializa dicts/datetimes bastante más rápido que el JSONResponse por defecto
+app = FastAPI(title="Plataforma Ajedrez Iván", lifespan=lifespan, default_response_class=ORJSONResponse)
 
 # Crea tablas (simple para MVP; luego migramos con Alembic)
 Base.metadata.create_all(bind=engine)
@@ -25,13 +54,15 @@ def root():
 
 @app.get("/lichess/perfil")
 def lichess_profile():
-    if not LICHESS_TOKEN:
+    token = primary_token()
+    if not token:
         raise HTTPException(status_code=500, detail="LICHESS_TOKEN no configurado")
 
-    r = requests.get(
-        "https://lichess.org/api/account",
-        headers={"Authorization": f"Bearer {LICHESS_TOKEN}"}
-    )
+    # Siempre la cuenta del token principal, no la del token que toque en el reparto
+    try:
+        r = pool.get("/api/account", token=token)
+    except LichessPoolExhausted as e:
+        raise _lichess_rate_limited(e)
     if r.status_code != 200:
         raise HTTPException(status_code=r.status_code, detail=r.text)
     return r.json()
@@ -54,9 +85,15 @@ def create_student(payload: StudentCreate, db: Session = Depends(get_db)):
     db.refresh(s)
     return s
 
+# Columnas de StudentOut precalculadas: el listado sale directo de las tuplas SQL
+_STUDENT_OUT_FIELDS = tuple(StudentOut.model_fields)
+_STUDENT_OUT_COLUMNS = tuple(getattr(Student, f) for f in _STUDENT_OUT_FIELDS)
+
 @app.get("/students", response_model=list[StudentOut])
 def list_students(db: Session = Depends(get_db)):
-    return db.query(Student).order_by(Student.id.desc()).all()
+    # Sin objetos ORM ni validación por fila: los datos ya vienen tipados de la DB
+    rows = db.query(*_STUDENT_OUT_COLUMNS).order_by(Student.id.desc()).all()
+    return ORJSONResponse([dict(zip(_STUDENT_OUT_FIELDS, r)) for r in rows])
 
 @app.get("/students/{student_id}", response_model=StudentOut)
 def get_student(student_id: int, db: Session = Depends(get_db)):
@@ -86,11 +123,7 @@ def student_lichess_games(
         raise HTTPException(status_code=404, detail="Estudiante no encontrado")
 
     # Lichess export user games (normalmente entrega NDJSON si se pide en Accept)
-    url = f"https://lichess.org/api/games/user/{s.lichess_username}"
     headers = {"Accept": "application/x-ndjson"}
-    # Si tienes token, ayuda a estabilidad/limitación
-    if LICHESS_TOKEN:
-        headers["Authorization"] = f"Bearer {LICHESS_TOKEN}"
 
     params = {
         "max": max_games,
@@ -99,11 +132,11 @@ def student_lichess_games(
         "opening": "true",
     }
 
-    r = requests.get(url, headers=headers, params=params, timeout=30)
-
-    if r.status_code == 429:
-        # Regla oficial: esperar un minuto si 429 :contentReference[oaicite:1]{index=1}
-        raise HTTPException(status_code=429, detail="Rate limit Lichess (429). Espera 60s y reintenta.")
+    # El pool elige un token sano y, ante un 429, reintenta con otro
+    try:
+        r = pool.get(f"/api/games/user/{s.lichess_username}", headers=headers, params=params, timeout=30)
+    except LichessPoolExhausted as e:
+        raise _lichess_rate_limited(e)
     if r.status_code != 200:
         raise HTTPException(status_code=r.status_code, detail=r.text)
 
@@ -114,101 +147,49 @@ def student_lichess_games(
     else:
         return {"format": "pgn", "pgn": r.text}
 
-from datetime import datetime, timezone
-
-def _ms_to_dt(ms: int | None):
-    if ms is None:
-        return None
-    return datetime.fromtimestamp(ms / 1000, tz=timezone.utc)
-
-def _safe_get(d: dict, path: list[str]):
-    cur = d
-    for k in path:
-        if not isinstance(cur, dict) or k not in cur:
-            return None
-        cur = cur[k]
-    return cur
-
-@app.post("/students/{student_id}/lichess/sync")
+@app.post("/students/{student_id}/lichess/sync", response_model=SyncJobOut, status_code=202)
 def sync_student_games(
     student_id: int,
-    max_games: int = Query(default=20, ge=1, le=50),
+    background_tasks: BackgroundTasks,
+    max_games: int = Query(default=20, ge=1, le=10000),
+    full_history: bool = Query(default=False),
     db: Session = Depends(get_db)
 ):
+    """
+    Encola (o reanuda) la sincronización como job persistido.
+    full_history=true ignora max_games e importa todas las partidas del estudiante.
+    Si ya hay un job sin terminar para el estudiante se devuelve ese mismo.
+    El progreso se consulta en GET /sync/jobs/{job_id}.
+    """
     s = db.query(Student).filter(Student.id == student_id).first()
     if not s:
         raise HTTPException(status_code=404, detail="Estudiante no encontrado")
 
-    url = f"https://lichess.org/api/games/user/{s.lichess_username}"
-    headers = {"Accept": "application/x-ndjson"}
-    if LICHESS_TOKEN:
-        headers["Authorization"] = f"Bearer {LICHESS_TOKEN}"
-
-    params = {
-        "max": max_games,
-        "moves": "true",
-        "clocks": "true",
-        "opening": "true",
-        "pgnInJson": "true",   # suele incluir PGN dentro del JSON cuando es NDJSON
-    }
-
-    r = requests.get(url, headers=headers, params=params, timeout=30)
-
-    if r.status_code == 429:
-        raise HTTPException(status_code=429, detail="Rate limit Lichess (429). Espera 60s y reintenta.")
-    if r.status_code != 200:
-        raise HTTPException(status_code=r.status_code, detail=r.text)
-
-    ct = (r.headers.get("content-type") or "").lower()
-    if "ndjson" not in ct:
-        raise HTTPException(status_code=500, detail="No recibí NDJSON; revisa parámetros/headers.")
-
-    games = _parse_ndjson(r.text)
-
-    inserted = 0
-    skipped = 0
-
-    for g in games:
-        gid = g.get("id")
-        if not gid:
-            continue
-
-        exists = db.query(Game).filter(
-            Game.student_id == s.id,
-            Game.lichess_game_id == gid
-        ).first()
-        if exists:
-            skipped += 1
-            continue
-
-        played_at = _ms_to_dt(g.get("createdAt") or g.get("lastMoveAt"))
-        speed = g.get("speed")
-        perf = _safe_get(g, ["perf", "name"]) or g.get("perf")
-        pgn = g.get("pgn")
-
-        row = Game(
-            student_id=s.id,
-            lichess_game_id=gid,
-            played_at=played_at,
-            speed=speed,
-            perf=str(perf) if perf is not None else None,
-            pgn=pgn,
-            json_raw=json.dumps(g)
-        )
-        db.add(row)
-        inserted += 1
-
-    db.commit()
-
-    return {
-        "student_id": s.id,
-        "lichess_username": s.lichess_username,
-        "requested": len(games),
-        "inserted": inserted,
-        "skipped_existing": skipped
-    }
-
-@app.get("/students/{student_id}/games")
+    job = get_or_create_job(db, s, None if full_history else max_games)
+    if job.status == "queued":
+        background_tasks.add_task(run_sync_job, job.id)
+    return job
+
+@app.get("/sync/jobs/{job_id}", response_model=SyncJobOut)
+def get_sync_job(job_id: int, db: Session = Depends(get_db)):
+    job = db.query(SyncJob).filter(SyncJob.id == job_id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Job no encontrado")
+    return job
+
+# ---------- ADMIN: POOL DE TOKENS LICHESS ----------
+@app.get("/admin/lichess/tokens", response_model=list[LichessTokenUsageOut], dependencies=[Depends(require_admin)])
+def lichess_tokens_usage():
+    """Uso por token: requests abiertos y totales, 429 recibidos, presupuesto del minuto y cooldown."""
+    return pool.usage()
+
+@app.post("/admin/lichess/tokens/reload", response_model=list[LichessTokenUsageOut], dependencies=[Depends(require_admin)])
+def lichess_tokens_reload(db: Session = Depends(get_db)):
+    """Vuelve a leer los tokens del entorno y de la tabla lichess_tokens."""
+    pool.load_from_db(db)
+    return pool.usage()
+
+@app.get("/students/{student_id}/games", response_model=StudentGamesOut)
 def list_games_from_db(
     student_id: int,
     limit: int = Query(default=20, ge=1, le=100),
@@ -218,7 +199,8 @@ def list_games_from_db(
     if not s:
         raise HTTPException(status_code=404, detail="Estudiante no encontrado")
 
-    rows = (db.query(Game)
+    # Solo las columnas que se devuelven (no cargamos pgn/json_raw)
+    rows = (db.query(Game.lichess_game_id, Game.played_at, Game.speed, Game.perf)
             .filter(Game.student_id == s.id)
             .order_by(Game.played_at.desc().nullslast(), Game.id.desc())
             .limit(limit)
@@ -243,12 +225,12 @@ from datetime import datetime, timezone, timedelta
 def _dt_now_utc():
     return datetime.now(timezone.utc)
 
-def _parse_game_row(row: Game) -> dict | None:
+def _parse_game_row(json_raw: str | None) -> dict | None:
     """Devuelve un dict del juego a partir de json_raw; si está dañado, None."""
-    if not row.json_raw:
+    if not json_raw:
         return None
     try:
-        return json.loads(row.json_raw)
+        return json.loads(json_raw)
     except Exception:
         return None
 
@@ -291,7 +273,7 @@ def _opening_name(g: dict) -> str | None:
             return name.strip()
     return None
 
-@app.get("/students/{student_id}/report")
+@app.get("/students/{student_id}/report", response_model=StudentReportOut)
 def student_pedagogical_report(
     student_id: int,
     days: int = Query(default=30, ge=7, le=365),
@@ -329,7 +311,7 @@ def student_pedagogical_report(
     # Traemos SOLO juegos dentro de ventana (y con límite)
     MAX_GAMES = 2000
     rows = (
-        db.query(Game)
+        db.query(Game.json_raw, Game.speed, Game.perf)   # sin pgn: no se usa aquí
         .filter(
             Game.student_id == s.id,
             Game.played_at != None,   # noqa: E711
@@ -348,7 +330,7 @@ def student_pedagogical_report(
     opening_counter = Counter()
 
     for row in rows:
-        g = _parse_game_row(row)
+        g = _parse_game_row(row.json_raw)
         in_window += 1
 
         # Resultado
@@ -467,7 +449,9 @@ def system_docs():
             "models.py → ORM models",
             "schemas.py → validation schemas",
             "db.py → database config",
-            "traffic_lights.py → pedagogical engine"
+            "traffic_lights.py → pedagogical engine",
+            "sync_jobs.py → resumable Lichess sync jobs",
+            "lichess_pool.py → Lichess token pool with per-token rate accounting"
         ],
         "docs": docs
     }
@@ -44,3 +44,65 @@ class Game(Base):
     )
 
     student = relationship("Student")
+
+from sqlalchemy import BigInteger, Index, text
+
+
+class SyncJob(Base):
+    __tablename__ = "sync_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    student_id = Column(Integer, ForeignKey("students.id", ondelete="CASCADE"), nullable=False, index=True)
+
+    status = Column(String(20), nullable=False, default="queued")   # queued/running/done/failed
+    max_games = Column(Integer, nullable=True)                      # None => historial completo (sin `max`)
+
+    # Checkpoint: createdAt (ms) de la última partida procesada.
+    # Lichess exporta de la más nueva a la más vieja, así que al reanudar
+    # pedimos `until=cursor_until - 1` y seguimos donde íbamos.
+    cursor_until = Column(BigInteger, nullable=True)
+
+    requested = Column(Integer, nullable=False, default=0)          # partidas recibidas de Lichess
+    inserted = Column(Integer, nullable=False, default=0)
+    skipped_existing = Column(Integer, nullable=False, default=0)
+
+    error = Column(Text, nullable=True)
+
+    # Dueño actual del job: cada worker que lo reclama escribe un lease nuevo.
+    # Checkpoints y estado final solo se escriben si el lease sigue siendo el suyo.
+    lease_id = Column(String(36), nullable=True)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    heartbeat_at = Column(DateTime(timezone=True), nullable=True)   # se actualiza en cada checkpoint
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        # Como mucho un job sin terminar por estudiante (evita jobs duplicados por doble POST)
+        Index(
+            "uq_sync_jobs_student_unfinished",
+            "student_id",
+            unique=True,
+            postgresql_where=text("status <> 'done'"),
+            sqlite_where=text("status <> 'done'"),
+        ),
+    )
+
+    student = relationship("Student")
+
+from sqlalchemy import Boolean
+
+
+class LichessToken(Base):
+    __tablename__ = "lichess_tokens"
+
+    id = Column(Integer, primary_key=True, index=True)
+    label = Column(String(60), nullable=False)          # "cuenta-profe-1", etc.
+    token = Column(String(120), nullable=False)
+    active = Column(Boolean, nullable=False, default=True)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("token", name="uq_lichess_tokens_token"),
+    )
@@ -15,3 +15,91 @@ class StudentOut(BaseModel):
 
     class Config:
         from_attributes = True
+
+from datetime import datetime
+
+class SyncJobOut(BaseModel):
+    id: int
+    student_id: int
+    status: str
+    max_games: int | None
+    cursor_until: int | None
+    requested: int
+    inserted: int
+    skipped_existing: int
+    error: str | None
+    created_at: datetime
+    started_at: datetime | None
+    heartbeat_at: datetime | None
+    finished_at: datetime | None
+
+    class Config:
+        from_attributes = True
+
+# ---------- RESPUESTAS TIPADAS (partidas / reporte) ----------
+class GameOut(BaseModel):
+    lichess_game_id: str
+    played_at: datetime | None
+    speed: str | None
+    perf: str | None
+
+class StudentGamesOut(BaseModel):
+    student_id: int
+    count: int
+    games: list[GameOut]
+
+class ReportStudent(BaseModel):
+    id: int
+    name: str
+    level: str
+    grade: str | None
+    lichess_username: str
+
+class ReportActivity(BaseModel):
+    days_window: int
+    games_in_window: int
+    games_last_7_days: int
+    games_per_week_estimated: float
+    last_played_at: datetime | None
+    days_since_last_game: int | None
+    games_last_7d: int
+
+class ReportPerformance(BaseModel):
+    wins: int
+    losses: int
+    draws: int
+    known_results: int
+    win_rate_percent: float
+
+class ReportProfile(BaseModel):
+    top_speeds: list[str]
+    top_perfs: list[str]
+    top_openings: list[str]
+
+class TrafficLightsOut(BaseModel):
+    activity: str
+    performance: str
+    stability: str
+    messages: list[str]
+
+class StudentReportOut(BaseModel):
+    student: ReportStudent
+    activity: ReportActivity
+    performance: ReportPerformance
+    profile: ReportProfile
+    traffic_lights: TrafficLightsOut
+
+class LichessTokenUsageOut(BaseModel):
+    label: str
+    source: str                     # env | db | anonymous
+    token: str | None               # enmascarado
+    healthy: bool
+    in_flight: int
+    requests_total: int
+    rate_limited_total: int
+    errors_total: int
+    requests_this_minute: int
+    budget_per_minute: int
+    cooldown_remaining_seconds: float
+    last_used_at: datetime | None
+    last_status: int | None
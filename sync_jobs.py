@@ -0,0 +1,315 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict
+
+from dotenv import load_dotenv
+from sqlalchemy import and_, or_
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.orm import Session
+
+from db import SessionLocal
+from lichess_pool import pool
+from models import Game, Student, SyncJob
+
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Cada cuántas partidas guardamos (commit de partidas + cursor en la misma transacción)
+CHUNK_SIZE = 200
+# Checkpoint también por tiempo, para que el heartbeat no dependa del ritmo del stream
+CHECKPOINT_EVERY_SECONDS = 30.0
+# Un job "running" sin checkpoint en este tiempo se considera huérfano (worker caído)
+STALE_AFTER = timedelta(minutes=5)
+# Cada cuánto el hilo de recuperación busca jobs pendientes/huérfanos
+RECOVERY_INTERVAL_SECONDS = int(os.getenv("SYNC_RECOVERY_INTERVAL", "60"))
+
+
+class LichessSyncError(Exception):
+    """Error recuperable al descargar de Lichess (HTTP != 200, formato)."""
+
+
+class SyncLeaseLost(Exception):
+    """Otro worker reclamó el job; este debe dejar de escribir."""
+
+
+def _dt_now_utc():
+    return datetime.now(timezone.utc)
+
+def _ms_to_dt(ms: int | None):
+    if ms is None:
+        return None
+    return datetime.fromtimestamp(ms / 1000, tz=timezone.utc)
+
+def _safe_get(d: dict, path: list[str]):
+    cur = d
+    for k in path:
+        if not isinstance(cur, dict) or k not in cur:
+            return None
+        cur = cur[k]
+    return cur
+
+
+# ---------- CREACIÓN / CONSULTA ----------
+def _unfinished_job(db: Session, student_id: int) -> SyncJob | None:
+    return (
+        db.query(SyncJob)
+        .filter(SyncJob.student_id == student_id, SyncJob.status != "done")
+        .order_by(SyncJob.id.desc())
+        .first()
+    )
+
+
+def get_or_create_job(db: Session, student: Student, max_games: int | None) -> SyncJob:
+    """
+    max_games=None => historial completo: se pide a Lichess sin `max` y el job
+    recorre todas las partidas hasta la más vieja (reanudable por cursor).
+    Idempotente: si el estudiante ya tiene un job sin terminar lo devolvemos.
+    Un job fallido se re-encola y continúa desde su último checkpoint,
+    así un reintento del cliente no vuelve a descargar todo.
+    El índice único parcial `uq_sync_jobs_student_unfinished` cubre dos POST simultáneos.
+    """
+    job = _unfinished_job(db, student.id)
+    if job is None:
+        job = SyncJob(student_id=student.id, status="queued", max_games=max_games)
+        db.add(job)
+        try:
+            db.commit()
+            db.refresh(job)
+            return job
+        except IntegrityError:
+            # Otro request creó el job entre la consulta y el insert: usamos ese
+            db.rollback()
+            job = _unfinished_job(db, student.id)
+
+    if job.status == "failed":
+        job.status = "queued"
+        job.error = None
+        job.finished_at = None
+        db.commit()
+        db.refresh(job)
+    return job
+
+
+def _claimable(now: datetime):
+    """Filtro: jobs en cola, o running sin checkpoint reciente (huérfanos)."""
+    return or_(
+        SyncJob.status == "queued",
+        and_(
+            SyncJob.status == "running",
+            or_(SyncJob.heartbeat_at == None, SyncJob.heartbeat_at < now - STALE_AFTER),  # noqa: E711
+        ),
+    )
+
+
+def _claim_job(db: Session, job_id: int) -> str | None:
+    """
+    Marca el job como running solo si está en cola o huérfano y le asigna un lease nuevo.
+    Es un UPDATE condicional: si dos workers lo intentan, solo uno gana.
+    Devuelve el lease, o None si no se pudo reclamar.
+    """
+    now = _dt_now_utc()
+    lease = uuid.uuid4().hex
+    claimed = (
+        db.query(SyncJob)
+        .filter(SyncJob.id == job_id, _claimable(now))
+        .update({"status": "running", "heartbeat_at": now, "lease_id": lease}, synchronize_session=False)
+    )
+    db.commit()
+    return lease if claimed == 1 else None
+
+
+def _guarded_update(db: Session, job_id: int, lease: str, values: Dict[str, Any]) -> None:
+    """
+    UPDATE ... WHERE id=:id AND lease_id=:lease y commit.
+    Si el lease ya no es nuestro, descarta la transacción (partidas incluidas) y aborta.
+    """
+    updated = (
+        db.query(SyncJob)
+        .filter(SyncJob.id == job_id, SyncJob.lease_id == lease)
+        .update(values, synchronize_session=False)
+    )
+    if updated != 1:
+        db.rollback()
+        raise SyncLeaseLost(f"El job {job_id} fue reclamado por otro worker")
+    db.commit()
+
+
+def _heartbeat(db: Session, job_id: int, lease: str) -> None:
+    _guarded_update(db, job_id, lease, {"heartbeat_at": _dt_now_utc()})
+
+
+# ---------- EJECUCIÓN ----------
+def _store_game(db: Session, student: Student, g: dict) -> bool | None:
+    """Inserta la partida si no existe. True=insertada, False=ya existía, None=sin id."""
+    gid = g.get("id")
+    if not gid:
+        return None
+
+    exists = db.query(Game.id).filter(
+        Game.student_id == student.id,
+        Game.lichess_game_id == gid
+    ).first()
+    if exists:
+        return False
+
+    perf = _safe_get(g, ["perf", "name"]) or g.get("perf")
+    db.add(Game(
+        student_id=student.id,
+        lichess_game_id=gid,
+        played_at=_ms_to_dt(g.get("createdAt") or g.get("lastMoveAt")),
+        speed=g.get("speed"),
+        perf=str(perf) if perf is not None else None,
+        pgn=g.get("pgn"),
+        json_raw=json.dumps(g)
+    ))
+    return True
+
+
+def _checkpoint(db: Session, job_id: int, lease: str, progress: Dict[str, Any]) -> None:
+    """Guarda partidas pendientes + cursor/contadores en la misma transacción."""
+    _guarded_update(db, job_id, lease, {**progress, "heartbeat_at": _dt_now_utc()})
+
+
+def _process_job(db: Session, job: SyncJob, lease: str, student: Student) -> None:
+    # El progreso vive en un dict local: el job solo se escribe con UPDATE protegido por lease
+    job_id = job.id
+    progress = {
+        "requested": job.requested,
+        "inserted": job.inserted,
+        "skipped_existing": job.skipped_existing,
+        "cursor_until": job.cursor_until,
+    }
+    headers = {"Accept": "application/x-ndjson"}
+
+    params = {
+        "moves": "true",
+        "clocks": "true",
+        "opening": "true",
+        "pgnInJson": "true",
+    }
+    if job.max_games is not None:
+        remaining = job.max_games - progress["requested"]
+        if remaining <= 0:
+            return
+        params["max"] = remaining
+    if progress["cursor_until"] is not None:
+        params["until"] = progress["cursor_until"] - 1
+
+    # wait=True: si todos los tokens están ocupados/en cooldown esperamos (un 429 no tumba el job);
+    # mientras tanto seguimos renovando el heartbeat para que no nos consideren huérfanos
+    _heartbeat(db, job_id, lease)
+    with pool.get(f"/api/games/user/{student.lichess_username}", headers=headers, params=params,
+                  timeout=30, stream=True, wait=True,
+                  on_wait=lambda: _heartbeat(db, job_id, lease)) as r:
+        if r.status_code != 200:
+            raise LichessSyncError(f"Lichess respondió {r.status_code}: {r.text[:500]}")
+
+        ct = (r.headers.get("content-type") or "").lower()
+        if "ndjson" not in ct:
+            raise LichessSyncError("No recibí NDJSON; revisa parámetros/headers.")
+
+        pending = 0
+        last_checkpoint = time.monotonic()
+        for line in r.iter_lines():
+            if not line or not line.strip():
+                continue
+            g = json.loads(line)
+
+            stored = _store_game(db, student, g)
+            progress["requested"] += 1
+            if stored is True:
+                progress["inserted"] += 1
+            elif stored is False:
+                progress["skipped_existing"] += 1
+
+            created = g.get("createdAt")
+            if isinstance(created, int):
+                progress["cursor_until"] = created
+
+            pending += 1
+            if pending >= CHUNK_SIZE or time.monotonic() - last_checkpoint >= CHECKPOINT_EVERY_SECONDS:
+                _checkpoint(db, job_id, lease, progress)
+                pending = 0
+                last_checkpoint = time.monotonic()
+
+    _checkpoint(db, job_id, lease, progress)
+
+
+def run_sync_job(job_id: int) -> None:
+    """Ejecuta (o reanuda) un job. Abre su propia sesión: corre fuera del request."""
+    db = SessionLocal()
+    try:
+        lease = _claim_job(db, job_id)
+        if lease is None:
+            return
+
+        job = db.get(SyncJob, job_id)
+        if job.started_at is None:
+            _guarded_update(db, job_id, lease, {"started_at": _dt_now_utc()})
+
+        final = {"status": "done", "error": None}
+        try:
+            student = db.get(Student, job.student_id)
+            if not student:
+                raise LichessSyncError("Estudiante no encontrado")
+            _process_job(db, job, lease, student)
+        except SyncLeaseLost:
+            raise
+        except Exception as e:
+            # Lo ya confirmado en checkpoints se conserva; solo perdemos el chunk en curso
+            db.rollback()
+            final = {"status": "failed", "error": str(e)[:2000]}
+
+        _guarded_update(db, job_id, lease, {**final, "finished_at": _dt_now_utc(), "lease_id": None})
+    except SyncLeaseLost:
+        logger.warning("Sync job %s: lease perdido, otro worker continúa el job", job_id)
+    finally:
+        db.close()
+
+
+# ---------- RECUPERACIÓN ----------
+def resume_pending_jobs() -> int:
+    """Ejecuta los jobs en cola o huérfanos. Devuelve cuántos se intentaron."""
+    db = SessionLocal()
+    try:
+        ids = [
+            x.id for x in db.query(SyncJob.id)
+            .filter(_claimable(_dt_now_utc()))
+            .order_by(SyncJob.id)
+            .all()
+        ]
+    finally:
+        db.close()
+
+    for job_id in ids:
+        run_sync_job(job_id)
+    return len(ids)
+
+
+def _recovery_loop(stop: threading.Event) -> None:
+    while not stop.is_set():
+        try:
+            resume_pending_jobs()
+        except OperationalError:
+            # La DB puede no estar disponible un momento; reintentamos en la siguiente vuelta
+            logger.warning("Recuperación de sync jobs: DB no disponible, se reintenta", exc_info=True)
+        except Exception:
+            # Cualquier otro error (p. ej. InterfaceError por conexión caída) se registra,
+            # pero el hilo sigue vivo: sin él no hay recuperación hasta reiniciar el proceso
+            logger.exception("Recuperación de sync jobs: error inesperado, se reintenta en la siguiente vuelta")
+        stop.wait(RECOVERY_INTERVAL_SECONDS)
+
+
+def start_recovery_thread() -> threading.Event:
+    """Arranca el hilo que reanuda jobs tras un reinicio. Devuelve el evento para detenerlo."""
+    stop = threading.Event()
+    threading.Thread(target=_recovery_loop, args=(stop,), name="sync-jobs-recovery", daemon=True).start()
+    return stop
@@ -0,0 +1,11 @@
+import os
+import pathlib
+import sys
+import tempfile
+
+# Los módulos del backend viven en la raíz del repo (sin paquete)
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+# Las pruebas nunca tocan la base real: db.py lee DATABASE_URL al importarse
+# (load_dotenv no pisa variables ya definidas)
+os.environ["DATABASE_URL"] = f"sqlite:///{pathlib.Path(tempfile.mkdtemp()) / 'tests.db'}"
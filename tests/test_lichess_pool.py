@@ -0,0 +1,157 @@
+"""
+Pool de tokens contra un servidor mock local que limita por token
+(responde 429 según la cabecera Authorization).
+"""
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from lichess_pool import LichessPoolExhausted, LichessTokenPool
+
+
+class MockLichess:
+    def __init__(self):
+        self.calls = Counter()       # token -> requests recibidos
+        self.limited = set()         # tokens que reciben 429
+        self._lock = threading.Lock()
+
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                token = (self.headers.get("Authorization") or "").removeprefix("Bearer ")
+                with mock._lock:
+                    mock.calls[token] += 1
+                    limited = token in mock.limited
+                body = b"{}" if not limited else b"Too Many Requests"
+                self.send_response(429 if limited else 200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def mock_lichess(monkeypatch):
+    monkeypatch.delenv("LICHESS_TOKEN", raising=False)
+    monkeypatch.delenv("LICHESS_TOKENS", raising=False)
+    mock = MockLichess()
+    yield mock
+    mock.close()
+
+
+def _pool(mock, tokens, **kwargs):
+    p = LichessTokenPool(base_url=mock.url, **kwargs)
+    p.load([("env", t) for t in tokens])
+    return p
+
+
+def _usage(p):
+    return {u["label"]: u for u in p.usage()}
+
+
+def test_calls_are_spread_across_tokens(mock_lichess):
+    p = _pool(mock_lichess, ["tok-a", "tok-b", "tok-c"])
+
+    for _ in range(9):
+        assert p.get("/api/account").status_code == 200
+
+    assert mock_lichess.calls == {"tok-a": 3, "tok-b": 3, "tok-c": 3}
+    assert all(u["requests_this_minute"] == 3 for u in p.usage())
+
+
+def test_cooldown_is_isolated_to_the_rate_limited_token(mock_lichess):
+    mock_lichess.limited.add("tok-a")
+    p = _pool(mock_lichess, ["tok-a", "tok-b"], cooldown_seconds=30)
+
+    # tok-a recibe 429 y la misma llamada se reintenta con tok-b
+    assert p.get("/api/account").status_code == 200
+    usage = _usage(p)
+    assert usage["env-1"]["rate_limited_total"] == 1
+    assert not usage["env-1"]["healthy"]
+    assert usage["env-1"]["cooldown_remaining_seconds"] > 29
+    assert usage["env-2"]["healthy"]
+    assert usage["env-2"]["rate_limited_total"] == 0
+
+    # Mientras dura el cooldown, tok-a no vuelve a recibir llamadas
+    for _ in range(3):
+        assert p.get("/api/account").status_code == 200
+    assert mock_lichess.calls == {"tok-a": 1, "tok-b": 4}
+
+
+def test_exhausted_retry_after_is_the_earliest_cooldown(mock_lichess):
+    mock_lichess.limited.update({"tok-a", "tok-b"})
+    p = _pool(mock_lichess, ["tok-a", "tok-b"], cooldown_seconds=30)
+
+    started = time.monotonic()
+    with pytest.raises(LichessPoolExhausted) as exc:
+        p.get("/api/account")
+    elapsed = time.monotonic() - started
+
+    assert mock_lichess.calls == {"tok-a": 1, "tok-b": 1}
+    assert 30 - elapsed <= exc.value.retry_after <= 30
+
+
+def test_exhausted_retry_after_is_the_budget_window(mock_lichess):
+    p = _pool(mock_lichess, ["tok-a"], budget_per_minute=2)
+
+    p.get("/api/account")
+    p.get("/api/account")
+    with pytest.raises(LichessPoolExhausted) as exc:
+        p.get("/api/account")
+
+    assert mock_lichess.calls == {"tok-a": 2}
+    assert 59 < exc.value.retry_after <= 60
+
+
+def test_streams_hold_their_token_until_closed(mock_lichess):
+    p = _pool(mock_lichess, ["tok-a", "tok-b"])
+
+    first = p.get("/api/games/user/x", stream=True)
+    second = p.get("/api/games/user/x", stream=True)
+    assert {u["label"]: u["in_flight"] for u in p.usage()} == {"env-1": 1, "env-2": 1}
+
+    # Ambos tokens tienen un export abierto: no se abre un tercero
+    with pytest.raises(LichessPoolExhausted):
+        p.get("/api/games/user/x", stream=True)
+
+    first.close()
+    with p.get("/api/games/user/x", stream=True):
+        assert _usage(p)["env-1"]["in_flight"] == 1
+    second.close()
+
+    assert all(u["in_flight"] == 0 for u in p.usage())
+    assert mock_lichess.calls == {"tok-a": 2, "tok-b": 1}
+
+
+def test_pinned_token_does_not_fall_back_to_others(mock_lichess):
+    mock_lichess.limited.add("tok-a")
+    p = _pool(mock_lichess, ["tok-a", "tok-b"], cooldown_seconds=30)
+
+    with pytest.raises(LichessPoolExhausted):
+        p.get("/api/account", token="tok-a")
+    assert mock_lichess.calls == {"tok-a": 1}
+
+
+def test_reload_updates_labels_and_keeps_counters(mock_lichess):
+    p = _pool(mock_lichess, ["tok-a"])
+    p.get("/api/account")
+
+    p.load([("db", "tok-a")], labels=["profe-1"])
+
+    usage = p.usage()
+    assert [(u["label"], u["source"], u["requests_total"]) for u in usage] == [("profe-1", "db", 1)]
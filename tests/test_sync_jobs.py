@@ -0,0 +1,208 @@
+"""
+Jobs de sync contra SQLite y un servidor mock del export NDJSON de Lichess
+(respeta `max` / `until` y puede cortar la conexión a mitad del stream).
+"""
+import json
+import threading
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+import sync_jobs as sj
+from db import Base, SessionLocal, engine
+from lichess_pool import LichessTokenPool
+from models import Game, Student, SyncJob
+
+
+NEWEST_MS = 1_700_000_000_000
+
+
+class MockExport:
+    def __init__(self, total: int):
+        self.games = [{"id": f"g{i:04d}", "createdAt": NEWEST_MS - i * 1000, "speed": "blitz"} for i in range(total)]
+        self.requests = []           # query params de cada llamada
+        self.truncate_after = None   # corta la primera respuesta tras N partidas
+
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                params = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+                mock.requests.append(params)
+
+                games = mock.games
+                if "until" in params:
+                    games = [g for g in games if g["createdAt"] <= int(params["until"])]
+                if "max" in params:
+                    games = games[:int(params["max"])]
+                lines = [json.dumps(g).encode() + b"\n" for g in games]
+
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Content-Length", str(sum(len(x) for x in lines)))
+                self.end_headers()
+                if mock.truncate_after is not None:
+                    # Content-Length completo pero cuerpo incompleto: el cliente falla a mitad del stream
+                    lines, mock.truncate_after = lines[:mock.truncate_after], None
+                    self.close_connection = True
+                self.wfile.write(b"".join(lines))
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def db():
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    session = SessionLocal()
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def export(monkeypatch):
+    monkeypatch.delenv("LICHESS_TOKEN", raising=False)
+    monkeypatch.delenv("LICHESS_TOKENS", raising=False)
+    mock = MockExport(total=50)
+    monkeypatch.setattr(sj, "pool", LichessTokenPool(base_url=mock.url))
+    monkeypatch.setattr(sj, "CHUNK_SIZE", 10)
+    yield mock
+    mock.close()
+
+
+def _student(db, username="ana"):
+    s = Student(full_name="Ana Bernal", level="primaria", lichess_username=username)
+    db.add(s)
+    db.commit()
+    return s
+
+
+def _job(db, job_id):
+    db.expire_all()
+    return db.get(SyncJob, job_id)
+
+
+def test_job_runs_queued_to_done(db, export):
+    job = sj.get_or_create_job(db, _student(db), 30)
+    assert job.status == "queued"
+
+    sj.run_sync_job(job.id)
+
+    job = _job(db, job.id)
+    assert (job.status, job.requested, job.inserted, job.skipped_existing) == ("done", 30, 30, 0)
+    assert job.lease_id is None and job.finished_at is not None
+    assert export.requests[0]["max"] == "30"
+    assert db.query(Game).count() == 30
+
+
+def test_failed_midstream_job_resumes_from_cursor(db, export):
+    export.truncate_after = 25
+    job = sj.get_or_create_job(db, _student(db), 100)
+
+    sj.run_sync_job(job.id)
+
+    # Solo sobreviven los chunks confirmados (2 x 10); el chunk a medias se descarta
+    job = _job(db, job.id)
+    assert job.status == "failed" and job.error
+    assert (job.requested, job.inserted) == (20, 20)
+    assert job.cursor_until == export.games[19]["createdAt"]
+    assert db.query(Game).count() == 20
+
+    # Reintento del cliente: mismo job, continúa desde el checkpoint
+    again = sj.get_or_create_job(db, db.get(Student, job.student_id), 100)
+    assert again.id == job.id and again.status == "queued"
+    sj.run_sync_job(job.id)
+
+    assert export.requests[1]["until"] == str(job.cursor_until - 1)
+    assert export.requests[1]["max"] == "80"
+    job = _job(db, job.id)
+    assert (job.status, job.requested, job.inserted, job.skipped_existing) == ("done", 50, 50, 0)
+    assert db.query(Game).count() == 50
+
+
+def test_full_history_job_requests_without_max(db, export):
+    job = sj.get_or_create_job(db, _student(db), None)
+
+    sj.run_sync_job(job.id)
+
+    assert "max" not in export.requests[0]
+    job = _job(db, job.id)
+    assert (job.status, job.max_games, job.inserted) == ("done", None, 50)
+    assert job.cursor_until == export.games[-1]["createdAt"]
+
+
+def test_stale_running_job_is_reclaimed_by_recovery(db, export):
+    now = sj._dt_now_utc()
+    stale = SyncJob(student_id=_student(db, "ana").id, status="running", max_games=10,
+                    lease_id="worker-caido", heartbeat_at=now - sj.STALE_AFTER - timedelta(minutes=1))
+    alive = SyncJob(student_id=_student(db, "beto").id, status="running", max_games=10,
+                    lease_id="worker-vivo", heartbeat_at=now)
+    db.add_all([stale, alive])
+    db.commit()
+
+    assert sj.resume_pending_jobs() == 1
+
+    stale, alive = _job(db, stale.id), _job(db, alive.id)
+    assert (stale.status, stale.inserted, stale.lease_id) == ("done", 10, None)
+    assert (alive.status, alive.lease_id) == ("running", "worker-vivo")
+
+
+def test_foreign_lease_raises_and_rolls_back_chunk(db, export):
+    job = sj.get_or_create_job(db, _student(db), 10)
+    lease = sj._claim_job(db, job.id)
+    assert lease and sj._claim_job(db, job.id) is None
+
+    # Otro worker reclama el job mientras este tiene un chunk sin confirmar
+    sj._store_game(db, db.get(Student, job.student_id), export.games[0])
+    with SessionLocal() as other:
+        other.query(SyncJob).filter(SyncJob.id == job.id).update({"lease_id": "otro-worker"})
+        other.commit()
+
+    with pytest.raises(sj.SyncLeaseLost):
+        sj._checkpoint(db, job.id, lease, {"requested": 1, "inserted": 1, "skipped_existing": 0,
+                                           "cursor_until": export.games[0]["createdAt"]})
+
+    job = _job(db, job.id)
+    assert (job.requested, job.cursor_until, job.lease_id) == (0, None, "otro-worker")
+    assert db.query(Game).count() == 0
+
+
+def test_concurrent_create_returns_existing_job(db, monkeypatch):
+    s = _student(db)
+    existing = sj.get_or_create_job(db, s, 10)
+
+    # Simula la carrera: la consulta no ve el job y el insert choca con el índice único
+    lookup = sj._unfinished_job
+    calls = iter([None])
+    monkeypatch.setattr(sj, "_unfinished_job", lambda db, sid: next(calls, None) or lookup(db, sid))
+
+    assert sj.get_or_create_job(db, s, 10).id == existing.id
+    assert db.query(SyncJob).count() == 1
+
+
+def test_second_post_returns_same_job(db, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    import main
+
+    monkeypatch.setattr(main, "run_sync_job", lambda job_id: None)
+    s = _student(db)
+    client = TestClient(main.app)
+
+    first = client.post(f"/students/{s.id}/lichess/sync", params={"max_games": 10})
+    second = client.post(f"/students/{s.id}/lichess/sync", params={"max_games": 10})
+
+    assert first.status_code == second.status_code == 202
+    assert first.json()["id"] == second.json()["id"]
+    assert client.get(f"/sync/jobs/{first.json()['id']}").json()["status"] == "queued"